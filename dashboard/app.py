@@ -1,10 +1,21 @@
 from flask import Flask, render_template, jsonify, request
+from flask.json.provider import JSONProvider
+import msgspec
+import orjson
 import random
+import atexit
+import bisect
 import certifi
 import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from typing import Union
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
 import pytz
 from dotenv import load_dotenv
 import uuid
@@ -13,7 +24,36 @@ from werkzeug.security import generate_password_hash, check_password_hash
 # Load environment variables from .env file
 load_dotenv()
 
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (handles datetime/UUID natively)"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response without a str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 app = Flask(__name__, static_folder='static', static_url_path='/static')
+app.json = ORJSONProvider(app)
+
+# Dates are bucketed in Pacific time to match the frontend
+PST = pytz.timezone('America/Los_Angeles')
+
+_iso_cache = (0, "")
+
+def now_iso():
+    """Local time as an ISO string at one-second precision, built once per second"""
+    global _iso_cache
+    second = int(time.time())
+    cached = _iso_cache
+    if cached[0] != second:
+        cached = _iso_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return cached[1]
 
 # MongoDB Atlas Connection (loaded from .env file for security)
 MONGO_URI = os.getenv('MONGO_URI')
@@ -35,7 +75,16 @@ else:
             MONGO_URI, 
             serverSelectionTimeoutMS=10000,
             tlsCAFile=certifi.where(),
-            tls=True
+            tls=True,
+            # Pool sized for concurrent Flask workers; idle sockets are recycled
+            maxPoolSize=100,
+            minPoolSize=10,
+            maxIdleTimeMS=60000,
+            socketTimeoutMS=20000,
+            # Wire compression (zstd needs the zstandard package, zlib is built in)
+            compressors="zstd,zlib",
+            retryWrites=True,
+            retryReads=True
         )
         client.admin.command('ping')
         db = client[DB_NAME]
@@ -61,6 +110,24 @@ else:
         user_data_collection = db['user_data']
         # Users credentials (email + hashed password) for login verification
         users_collection = db['users']
+
+        # Indexes for the date range scans and lookups below. The unique alert
+        # index also enforces one alert per room/day/type; it can fail on
+        # duplicates left by the old check-then-insert, so each index is
+        # created on its own and one failure doesn't skip the rest.
+        index_specs = [(usage_collection, [('date', 1)], {})]
+        index_specs += [(room_collection, [('date', 1)], {}) for room_collection in room_collections.values()]
+        index_specs += [
+            (device_collection, [('date', 1)], {}),
+            (user_data_collection, [('email', 1), ('loggedInAt', -1)], {}),
+            (users_collection, [('email', 1)], {}),
+            (alert_collection, [('room_id', 1), ('date', 1), ('type', 1)], {'unique': True}),
+        ]
+        for collection, keys, options in index_specs:
+            try:
+                collection.create_index(keys, **options)
+            except Exception as e:
+                print(f"⚠️ Failed to create index {keys} on {collection.name}: {e}")
         
         print("✅ Connected to MongoDB Atlas")
         print("📦 Room collections: living, bedroom, kitchen, bathroom, office, garage")
@@ -89,31 +156,118 @@ else:
         user_data_collection = None
         users_collection = None
 
-# Simulated sensor data storage
-sensor_history = []
-
-def generate_sensor_reading():
-    """Simulate a light sensor reading (0-50 lux)"""
-    hour = datetime.now().hour
-    if 6 <= hour <= 18:
-        base = 25 + (15 * (1 - abs(hour - 12) / 6))
-    else:
-        base = 10
+# ===== Batched Writes =====
+# Fire-and-forget writes are queued and flushed by a background thread as one
+# unordered bulk_write per collection, instead of one round trip per request.
+
+WRITE_FLUSH_INTERVAL = 0.1  # seconds
+WRITE_BATCH_SIZE = 200
+
+write_queue = queue.Queue()
+_flush_now = threading.Event()
+_flush_lock = threading.Lock()
+
+def enqueue_write(collection, op, key=None):
+    """Queue a pymongo write op for collection.
+
+    Ops that share a key within one flush are collapsed to the latest, so an
+    unordered bulk_write can never apply an older upsert after a newer one.
+    """
+    write_queue.put((collection, key, op))
+    if write_queue.qsize() >= WRITE_BATCH_SIZE:
+        _flush_now.set()
+
+def flush_writes():
+    """Drain the write queue and send one bulk_write per collection"""
+    with _flush_lock:
+        batches = {}
+        while True:
+            try:
+                collection, key, op = write_queue.get_nowait()
+            except queue.Empty:
+                break
+            _, ops = batches.setdefault(collection.name, (collection, {}))
+            ops[key if key is not None else object()] = op
+
+        for collection, ops in batches.values():
+            try:
+                collection.bulk_write(list(ops.values()), ordered=False)
+            except Exception as e:
+                print(f"⚠️ Failed to flush {len(ops)} writes to {collection.name}: {e}")
+            # Saved usage only becomes visible now, so drop cached totals here
+            invalidate_stats_cache(collection.name)
+
+def _write_flusher():
+    while True:
+        _flush_now.wait(WRITE_FLUSH_INTERVAL)
+        _flush_now.clear()
+        flush_writes()
+
+# Simulated sensor data storage (ring buffer: oldest reading drops off at capacity)
+HISTORY_SIZE = 50
+sensor_history = deque(maxlen=HISTORY_SIZE)
+
+# Running aggregates over sensor_history so /api/stats never rescans it.
+# The min/max windows are monotonic deques of (seq, lux) pairs.
+_history_lock = threading.Lock()
+_history_seq = 0
+_lux_sum = 0.0
+_lux_min_window = deque()
+_lux_max_window = deque()
+
+def record_reading(reading):
+    """Append a reading to the history and update the running stats"""
+    global _history_seq, _lux_sum
+    lux = reading["lux"]
+    with _history_lock:
+        if len(sensor_history) == HISTORY_SIZE:
+            # The oldest reading is about to be evicted by the deque
+            evicted_seq = _history_seq - HISTORY_SIZE
+            _lux_sum -= sensor_history[0]["lux"]
+            if _lux_min_window[0][0] == evicted_seq:
+                _lux_min_window.popleft()
+            if _lux_max_window[0][0] == evicted_seq:
+                _lux_max_window.popleft()
+
+        sensor_history.append(reading)
+        _lux_sum += lux
+        while _lux_min_window and _lux_min_window[-1][1] >= lux:
+            _lux_min_window.pop()
+        _lux_min_window.append((_history_seq, lux))
+        while _lux_max_window and _lux_max_window[-1][1] <= lux:
+            _lux_max_window.pop()
+        _lux_max_window.append((_history_seq, lux))
+        _history_seq += 1
+
+# Diurnal base lux for each hour of the day: peaks at noon, flat at night
+HOURLY_BASE_LUX = [
+    25 + (15 * (1 - abs(hour - 12) / 6)) if 6 <= hour <= 18 else 10
+    for hour in range(24)
+]
+
+def generate_sensor_reading(hour=None):
+    """Simulate a light sensor reading (0-50 lux) for hour (default: now)"""
+    if hour is None:
+        hour = datetime.now().hour
     noise = random.gauss(0, 5)
-    return max(0, min(50, base + noise))
+    return max(0, min(50, HOURLY_BASE_LUX[hour] + noise))
+
+# Status buckets: lux below STATUS_THRESHOLDS[i] maps to STATUS_LEVELS[i]
+STATUS_THRESHOLDS = [15, 25, 35, 50]
+STATUS_LEVELS = [
+    {"level": "Dark", "color": "#1a1a2e", "icon": "🌙"},
+    {"level": "Dim", "color": "#16213e", "icon": "🌆"},
+    {"level": "Normal", "color": "#e94560", "icon": "☀️"},
+    {"level": "Bright", "color": "#f39c12", "icon": "🌞"},
+    {"level": "Very Bright", "color": "#f1c40f", "icon": "⚡"},
+]
 
 def get_sensor_status(lux):
-    """Determine status based on light level"""
-    if lux < 15:
-        return {"level": "Dark", "color": "#1a1a2e", "icon": "🌙"}
-    elif lux < 25:
-        return {"level": "Dim", "color": "#16213e", "icon": "🌆"}
-    elif lux < 35:
-        return {"level": "Normal", "color": "#e94560", "icon": "☀️"}
-    elif lux < 50:
-        return {"level": "Bright", "color": "#f39c12", "icon": "🌞"}
-    else:
-        return {"level": "Very Bright", "color": "#f1c40f", "icon": "⚡"}
+    """Determine status based on light level.
+
+    Returns one of the shared STATUS_LEVELS dicts; callers must not mutate it.
+    """
+    return STATUS_LEVELS[bisect.bisect_right(STATUS_THRESHOLDS, lux)]
 
 @app.route('/')
 def dashboard():
@@ -128,7 +282,7 @@ def get_sensor_data():
     """Get current sensor reading"""
     lux = generate_sensor_reading()
     status = get_sensor_status(lux)
-    timestamp = datetime.now().isoformat()
+    timestamp = now_iso()
     
     reading = {
         "lux": round(lux, 1),
@@ -136,68 +290,131 @@ def get_sensor_data():
         "status": status
     }
     
-    sensor_history.append(reading)
-    if len(sensor_history) > 50:
-        sensor_history.pop(0)
+    record_reading(reading)
     
     return jsonify(reading)
 
 @app.route('/api/history')
 def get_history():
-    return jsonify(sensor_history)
+    return jsonify(list(sensor_history))
 
 @app.route('/api/stats')
 def get_stats():
-    if not sensor_history:
-        return jsonify({"avg": 0, "min": 0, "max": 0, "readings": 0})
+    with _history_lock:
+        count = len(sensor_history)
+        if not count:
+            return jsonify({"avg": 0, "min": 0, "max": 0, "readings": 0})
+        lux_sum = _lux_sum
+        lux_min = _lux_min_window[0][1]
+        lux_max = _lux_max_window[0][1]
     
-    lux_values = [r["lux"] for r in sensor_history]
     return jsonify({
-        "avg": round(sum(lux_values) / len(lux_values), 1),
-        "min": round(min(lux_values), 1),
-        "max": round(max(lux_values), 1),
-        "readings": len(sensor_history)
+        "avg": round(lux_sum / count, 1),
+        "min": round(lux_min, 1),
+        "max": round(lux_max, 1),
+        "readings": count
     })
 
 # ===== MongoDB Usage API =====
 
+# Request bodies for the save endpoints, decoded and type-checked in one pass
+class UsagePayload(msgspec.Struct):
+    date: str
+    onSeconds: Union[int, float] = 0
+
+class RoomUsagePayload(msgspec.Struct):
+    date: str
+    onSeconds: Union[int, float] = 0
+    avgLux: Union[int, float] = 0
+
+usage_decoder = msgspec.json.Decoder(UsagePayload)
+room_usage_decoder = msgspec.json.Decoder(RoomUsagePayload)
+
+def sum_on_seconds(collection, week_start_str, month_start_str, today_str):
+    """Sum onSeconds for the week and month before today in one aggregation.
+
+    Returns a (weekly, monthly) tuple. The week can start in the previous
+    month, so the match covers whichever range starts first.
+    """
+    pipeline = [
+        {"$match": {"date": {"$gte": min(week_start_str, month_start_str), "$lt": today_str}}},
+        {"$group": {
+            "_id": None,
+            "weekly": {"$sum": {"$cond": [{"$gte": ["$date", week_start_str]}, "$onSeconds", 0]}},
+            "monthly": {"$sum": {"$cond": [{"$gte": ["$date", month_start_str]}, "$onSeconds", 0]}}
+        }}
+    ]
+    totals = next(collection.aggregate(pipeline), None)
+    if not totals:
+        return 0, 0
+    return totals.get('weekly', 0), totals.get('monthly', 0)
+
+# Short-lived cache for the week/month totals, which only change when saved
+# usage is flushed or reset. Keyed by (today_str, collection name).
+STATS_CACHE_TTL = 30  # seconds
+_stats_cache = {}
+
+def cached_on_seconds(collection, week_start_str, month_start_str, today_str):
+    """sum_on_seconds() served from the stats cache while it is fresh"""
+    key = (today_str, collection.name)
+    now = time.monotonic()
+    cached = _stats_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    totals = sum_on_seconds(collection, week_start_str, month_start_str, today_str)
+    # Drop entries from previous days before storing today's
+    for stale in [k for k in list(_stats_cache) if k[0] != today_str]:
+        _stats_cache.pop(stale, None)
+    _stats_cache[key] = (now + STATS_CACHE_TTL, totals)
+    return totals
+
+def invalidate_stats_cache(collection_name):
+    for key in [k for k in list(_stats_cache) if k[1] == collection_name]:
+        _stats_cache.pop(key, None)
+
 @app.route('/api/usage/reset', methods=['POST'])
 def reset_usage():
     """Reset all usage data"""
     if usage_collection is not None:
+        # Write out queued saves first, or the flusher would re-create them after the delete
+        flush_writes()
         usage_collection.delete_many({})
+        invalidate_stats_cache(usage_collection.name)
         return jsonify({"success": True, "message": "All data cleared"})
     return jsonify({"success": False, "message": "MongoDB not available"})
 
 @app.route('/api/usage/save', methods=['POST'])
 def save_usage():
     """Save daily usage data"""
-    data = request.json
-    
-    if not data or 'date' not in data:
+    try:
+        data = usage_decoder.decode(request.get_data())
+    except msgspec.DecodeError:
         return jsonify({"error": "Invalid data"}), 400
     
     usage_data = {
-        "date": data['date'],
-        "onSeconds": data.get('onSeconds', 0),
-        "offSeconds": 86400 - data.get('onSeconds', 0),
-        "updatedAt": datetime.now().isoformat()
+        "date": data.date,
+        "onSeconds": data.onSeconds,
+        "offSeconds": 86400 - data.onSeconds,
+        "updatedAt": now_iso()
     }
     
     if usage_collection is not None:
-        usage_collection.update_one(
-            {"date": data['date']},
-            {"$set": usage_data},
-            upsert=True
+        enqueue_write(
+            usage_collection,
+            UpdateOne({"date": data.date}, {"$set": usage_data}, upsert=True),
+            key=data.date
         )
-        return jsonify({"success": True})
+        return jsonify({"success": True}), 202
     return jsonify({"success": False, "message": "MongoDB not available"})
 
 @app.route('/api/usage/<date>')
 def get_usage(date):
     """Get usage for a specific date"""
     if usage_collection is not None:
-        record = usage_collection.find_one({"date": date})
+        record = usage_collection.find_one(
+            {"date": date}, {"_id": 0, "date": 1, "onSeconds": 1, "offSeconds": 1}
+        )
         if record:
             return jsonify({
                 "date": record['date'],
@@ -210,8 +427,7 @@ def get_usage(date):
 def get_usage_statistics():
     """Get weekly and monthly statistics EXCLUDING today (today is tracked live in frontend)"""
     # Use PST timezone to match frontend
-    pst = pytz.timezone('America/Los_Angeles')
-    today = datetime.now(pst)
+    today = datetime.now(PST)
     today_str = today.strftime('%Y-%m-%d')
     
     # Calculate week start as SUNDAY (Python weekday: Mon=0, Sun=6)
@@ -225,17 +441,10 @@ def get_usage_statistics():
     monthly_seconds = 0
     
     if usage_collection is not None:
-        # This week EXCLUDING today (frontend adds live dailySeconds)
-        week_records = list(usage_collection.find({
-            "date": {"$gte": week_start_str, "$lt": today_str}
-        }))
-        weekly_seconds = sum(r.get('onSeconds', 0) for r in week_records)
-        
-        # This month EXCLUDING today (frontend adds live dailySeconds)
-        month_records = list(usage_collection.find({
-            "date": {"$gte": month_start_str, "$lt": today_str}
-        }))
-        monthly_seconds = sum(r.get('onSeconds', 0) for r in month_records)
+        # Both totals EXCLUDE today (frontend adds live dailySeconds)
+        weekly_seconds, monthly_seconds = cached_on_seconds(
+            usage_collection, week_start_str, month_start_str, today_str
+        )
     
     return jsonify({
         "daily": 0,  # Not used - frontend tracks today live
@@ -247,30 +456,35 @@ def get_usage_statistics():
 
 VALID_ROOMS = ['living', 'bedroom', 'kitchen', 'bathroom', 'office', 'garage']
 
+# Rooms live in separate collections; fan per-room writes out in parallel
+# (MongoClient is thread-safe and pools connections)
+room_executor = ThreadPoolExecutor(max_workers=len(VALID_ROOMS))
+
 @app.route('/api/room/<room_name>/save', methods=['POST'])
 def save_room_usage(room_name):
     """Save daily usage data for a specific room"""
     if room_name not in VALID_ROOMS:
         return jsonify({"error": f"Invalid room. Valid rooms: {VALID_ROOMS}"}), 400
     
-    data = request.json
-    if not data or 'date' not in data:
+    try:
+        data = room_usage_decoder.decode(request.get_data())
+    except msgspec.DecodeError:
         return jsonify({"error": "Invalid data"}), 400
     
     room_data = {
-        "date": data['date'],
-        "onSeconds": data.get('onSeconds', 0),
-        "avgLux": data.get('avgLux', 0),
-        "updatedAt": datetime.now().isoformat()
+        "date": data.date,
+        "onSeconds": data.onSeconds,
+        "avgLux": data.avgLux,
+        "updatedAt": now_iso()
     }
     
     if room_name in room_collections and room_collections[room_name] is not None:
-        room_collections[room_name].update_one(
-            {"date": data['date']},
-            {"$set": room_data},
-            upsert=True
+        enqueue_write(
+            room_collections[room_name],
+            UpdateOne({"date": data.date}, {"$set": room_data}, upsert=True),
+            key=data.date
         )
-        return jsonify({"success": True, "room": room_name})
+        return jsonify({"success": True, "room": room_name}), 202
     return jsonify({"success": False, "message": "MongoDB not available"})
 
 @app.route('/api/room/<room_name>/<date>')
@@ -280,7 +494,9 @@ def get_room_usage(room_name, date):
         return jsonify({"error": f"Invalid room. Valid rooms: {VALID_ROOMS}"}), 400
     
     if room_name in room_collections and room_collections[room_name] is not None:
-        record = room_collections[room_name].find_one({"date": date})
+        record = room_collections[room_name].find_one(
+            {"date": date}, {"_id": 0, "date": 1, "onSeconds": 1, "avgLux": 1}
+        )
         if record:
             return jsonify({
                 "room": room_name,
@@ -296,8 +512,7 @@ def get_room_statistics(room_name):
     if room_name not in VALID_ROOMS:
         return jsonify({"error": f"Invalid room. Valid rooms: {VALID_ROOMS}"}), 400
     
-    pst = pytz.timezone('America/Los_Angeles')
-    today = datetime.now(pst)
+    today = datetime.now(PST)
     today_str = today.strftime('%Y-%m-%d')
     
     weekday = today.weekday()
@@ -309,17 +524,10 @@ def get_room_statistics(room_name):
     monthly_seconds = 0
     
     if room_name in room_collections and room_collections[room_name] is not None:
-        # This week excluding today
-        week_records = list(room_collections[room_name].find({
-            "date": {"$gte": week_start_str, "$lt": today_str}
-        }))
-        weekly_seconds = sum(r.get('onSeconds', 0) for r in week_records)
-        
-        # This month excluding today
-        month_records = list(room_collections[room_name].find({
-            "date": {"$gte": month_start_str, "$lt": today_str}
-        }))
-        monthly_seconds = sum(r.get('onSeconds', 0) for r in month_records)
+        # Both totals exclude today
+        weekly_seconds, monthly_seconds = cached_on_seconds(
+            room_collections[room_name], week_start_str, month_start_str, today_str
+        )
     
     return jsonify({
         "room": room_name,
@@ -330,27 +538,40 @@ def get_room_statistics(room_name):
 @app.route('/api/rooms/all/<date>')
 def get_all_rooms_usage(date):
     """Get usage for all rooms on a specific date"""
-    result = {}
-    for room_name in VALID_ROOMS:
-        if room_name in room_collections and room_collections[room_name] is not None:
-            record = room_collections[room_name].find_one({"date": date})
-            if record:
-                result[room_name] = {
-                    "onSeconds": record.get('onSeconds', 0),
-                    "avgLux": record.get('avgLux', 0)
-                }
-            else:
-                result[room_name] = {"onSeconds": 0, "avgLux": 0}
-        else:
-            result[room_name] = {"onSeconds": 0, "avgLux": 0}
+    result = {room_name: {"onSeconds": 0, "avgLux": 0} for room_name in VALID_ROOMS}
+
+    rooms = [r for r in VALID_ROOMS if room_collections.get(r) is not None]
+    if rooms:
+        def room_stages(room_name):
+            return [
+                {"$match": {"date": date}},
+                {"$project": {"_id": 0, "room": {"$literal": room_name}, "onSeconds": 1, "avgLux": 1}}
+            ]
+
+        # One round trip: the first room's pipeline $unionWith's the others
+        pipeline = room_stages(rooms[0]) + [
+            {"$unionWith": {"coll": room_collections[r].name, "pipeline": room_stages(r)}}
+            for r in rooms[1:]
+        ]
+        for record in room_collections[rooms[0]].aggregate(pipeline):
+            result[record['room']] = {
+                "onSeconds": record.get('onSeconds', 0),
+                "avgLux": record.get('avgLux', 0)
+            }
     return jsonify({"date": date, "rooms": result})
 
 @app.route('/api/rooms/reset', methods=['POST'])
 def reset_all_rooms():
     """Reset all room usage data"""
-    for room_name in VALID_ROOMS:
+    def clear_room(room_name):
         if room_name in room_collections and room_collections[room_name] is not None:
             room_collections[room_name].delete_many({})
+            invalidate_stats_cache(room_collections[room_name].name)
+
+    # Write out queued saves first, or the flusher would re-create them after the delete
+    flush_writes()
+    # list() waits for every delete and re-raises the first failure
+    list(room_executor.map(clear_room, VALID_ROOMS))
     return jsonify({"success": True, "message": "All room data cleared"})
 
 # ===== Admin Access Logging =====
@@ -366,17 +587,13 @@ def log_admin_access():
 
     doc = {
         "username": username,
-        "accessedAt": datetime.now().isoformat(),
+        "accessedAt": now_iso(),
         "ip": request.remote_addr,
         "userAgent": request.headers.get('User-Agent', ''),
         "path": "/info",
     }
-    try:
-        admin_collection.insert_one(doc)
-        return jsonify({"success": True})
-    except Exception as e:
-        print(f"⚠️ Failed to log admin access: {e}")
-        return jsonify({"success": False, "message": "Failed to log admin access"}), 500
+    enqueue_write(admin_collection, InsertOne(doc))
+    return jsonify({"success": True}), 202
 
 
 # ===== Alert Logging (Lights on > 40 minutes) =====
@@ -391,28 +608,24 @@ def create_alert():
     room_id = (data.get('room_id') or 'unknown').strip()
     duration_seconds = int(data.get('durationSeconds') or 0)
     alert_type = data.get('type', 'duration_over_40min')
-    date = data.get('date') or datetime.now(pytz.timezone('America/Los_Angeles')).strftime('%Y-%m-%d')
-
-    # Avoid duplicate alerts for the same room/day/type
-    existing = alert_collection.find_one({
-        "room_id": room_id,
-        "date": date,
-        "type": alert_type
-    })
-    if existing:
-        return jsonify({"success": True, "skipped": True})
+    date = data.get('date') or datetime.now(PST).strftime('%Y-%m-%d')
 
     doc = {
         "alert_id": str(uuid.uuid4()),
-        "room_id": room_id,
-        "date": date,
         "durationSeconds": duration_seconds,
-        "type": alert_type,
-        "createdAt": datetime.now().isoformat(),
+        "createdAt": now_iso(),
     }
     try:
-        alert_collection.insert_one(doc)
-        return jsonify({"success": True})
+        # One alert per room/day/type: the upsert only inserts when none exists
+        res = alert_collection.update_one(
+            {"room_id": room_id, "date": date, "type": alert_type},
+            {"$setOnInsert": doc},
+            upsert=True
+        )
+        return jsonify({"success": True, "skipped": res.upserted_id is None})
+    except DuplicateKeyError:
+        # Lost a race with a concurrent upsert for the same alert
+        return jsonify({"success": True, "skipped": True})
     except Exception as e:
         print(f"⚠️ Failed to create alert: {e}")
         return jsonify({"success": False, "message": "Failed to create alert"}), 500
@@ -438,26 +651,26 @@ def user_login():
 
     login_doc = {
         "email": email,
-        "loggedInAt": datetime.now().isoformat(),
+        "loggedInAt": now_iso(),
         "ip": request.remote_addr,
         "userAgent": request.headers.get('User-Agent', ''),
     }
 
     try:
-        existing = users_collection.find_one({"email": email})
+        existing = users_collection.find_one({"email": email}, {"_id": 0, "password_hash": 1})
         if existing is None:
             # First-time user: save email + hashed password
             password_hash = generate_password_hash(password, method="pbkdf2:sha256")
             users_collection.insert_one({
                 "email": email,
                 "password_hash": password_hash,
-                "createdAt": datetime.now().isoformat(),
+                "createdAt": now_iso(),
             })
-            user_data_collection.insert_one(login_doc)
+            enqueue_write(user_data_collection, InsertOne(login_doc))
             return jsonify({"success": True})
         # Returning user: verify password
         if check_password_hash(existing["password_hash"], password):
-            user_data_collection.insert_one(login_doc)
+            enqueue_write(user_data_collection, InsertOne(login_doc))
             return jsonify({"success": True})
         return jsonify({"success": False, "message": "Invalid password"}), 401
     except Exception as e:
@@ -479,8 +692,7 @@ def log_device():
     room_name = data.get('room_name', '')  # Human-readable room name
     
     # Use PST timezone to match frontend
-    pst = pytz.timezone('America/Los_Angeles')
-    now_pst = datetime.now(pst)
+    now_pst = datetime.now(PST)
     
     doc = {
         "action_type": action_type,
@@ -491,23 +703,30 @@ def log_device():
         "timestamp": now_pst.isoformat(),
         "ip": request.remote_addr,
         "userAgent": request.headers.get('User-Agent', ''),
-        "createdAt": datetime.now().isoformat(),
+        "createdAt": now_iso(),
     }
     
-    try:
-        device_collection.insert_one(doc)
-        return jsonify({"success": True})
-    except Exception as e:
-        print(f"⚠️ Failed to log device: {e}")
-        return jsonify({"success": False, "message": "Failed to log device"}), 500
-
-if __name__ == '__main__':
-    for i in range(20):
-        lux = generate_sensor_reading()
-        sensor_history.append({
+    enqueue_write(device_collection, InsertOne(doc))
+    return jsonify({"success": True}), 202
+
+# Start the write flusher once every handler and cache helper is defined
+if db is not None:
+    threading.Thread(target=_write_flusher, name="mongo-write-flusher", daemon=True).start()
+    atexit.register(flush_writes)
+
+def seed_history(count=20, interval_seconds=3):
+    """Fill the history with count demo readings ending now"""
+    now = datetime.now()
+    timestamps = [now - timedelta(seconds=(count - i) * interval_seconds) for i in range(count)]
+    for ts in timestamps:
+        lux = generate_sensor_reading(ts.hour)
+        record_reading({
             "lux": round(lux, 1),
-            "timestamp": (datetime.now() - timedelta(seconds=(20-i)*3)).isoformat(),
+            "timestamp": ts.isoformat(timespec='seconds'),
             "status": get_sensor_status(lux)
         })
+
+if __name__ == '__main__':
+    seed_history()
     
     app.run(debug=True, port=5001)
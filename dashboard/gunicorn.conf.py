@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+#
+# Production server for the dashboard (run from this directory):
+#   gunicorn
+#
+# The gevent worker monkey-patches sockets before the app is imported, so
+# pymongo round trips yield to other requests instead of blocking the worker.
+# Simulated sensor history and the stats cache live in process memory, so
+# keep one worker unless those move to a shared store. The reset and admin
+# endpoints are unauthenticated, so it listens on localhost only unless BIND
+# says otherwise (e.g. BIND=0.0.0.0:5001 behind a proxy).
+import os
+
+wsgi_app = "app:app"
+bind = os.getenv("BIND", "127.0.0.1:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gevent"
+worker_connections = 500
@@ -2,7 +2,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from app import get_sensor_status, generate_sensor_reading
+import app as dashboard_app
+from app import app, get_sensor_status, generate_sensor_reading, enqueue_write, HISTORY_SIZE
 
 def test_sensor_status_dark():
     result = get_sensor_status(10)
@@ -12,7 +13,60 @@ def test_sensor_status_normal():
     result = get_sensor_status(30)
     assert result["level"] == "Normal"
 
+def test_sensor_status_boundaries():
+    assert get_sensor_status(14.9)["level"] == "Dark"
+    assert get_sensor_status(15)["level"] == "Dim"
+    assert get_sensor_status(49.9)["level"] == "Bright"
+    assert get_sensor_status(50)["level"] == "Very Bright"
+
 def test_generate_sensor_range():
     for _ in range(100):
         value = generate_sensor_reading()
         assert 0 <= value <= 50
+
+def test_history_is_capped():
+    client = app.test_client()
+    for _ in range(HISTORY_SIZE + 10):
+        client.get('/api/sensor')
+    history = client.get('/api/history').get_json()
+    assert len(history) == HISTORY_SIZE
+
+def test_stats_match_history():
+    client = app.test_client()
+    for _ in range(HISTORY_SIZE * 2):
+        client.get('/api/sensor')
+    lux_values = [r["lux"] for r in client.get('/api/history').get_json()]
+    stats = client.get('/api/stats').get_json()
+    assert stats["readings"] == len(lux_values)
+    assert stats["min"] == min(lux_values)
+    assert stats["max"] == max(lux_values)
+    assert abs(stats["avg"] - sum(lux_values) / len(lux_values)) <= 0.05 + 1e-9
+
+class RecordingCollection:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls.append(("bulk_write", self.name))
+
+    def delete_many(self, query):
+        self.calls.append(("delete_many", self.name))
+
+def test_reset_flushes_queued_saves_first(monkeypatch):
+    calls = []
+    usage = RecordingCollection("daily_usage", calls)
+    rooms = {room: RecordingCollection(f"room_{room}", calls) for room in dashboard_app.VALID_ROOMS}
+    monkeypatch.setattr(dashboard_app, "usage_collection", usage)
+    monkeypatch.setattr(dashboard_app, "room_collections", rooms)
+    client = app.test_client()
+
+    enqueue_write(usage, "queued-save", key="2026-02-01")
+    client.post('/api/usage/reset')
+    assert calls == [("bulk_write", "daily_usage"), ("delete_many", "daily_usage")]
+
+    calls.clear()
+    enqueue_write(rooms["kitchen"], "queued-save", key="2026-02-01")
+    client.post('/api/rooms/reset')
+    assert calls[0] == ("bulk_write", "room_kitchen")
+    assert sorted(calls[1:]) == sorted(("delete_many", r.name) for r in rooms.values())
@@ -1,17 +1,52 @@
 import os
 import hashlib
 import json
+import threading
+import time
 import uuid
 import pytz
 
+from concurrent.futures import Future
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template_string, request
+import orjson
+from flask import Flask, Response, jsonify, render_template, request
+from flask.json.provider import DefaultJSONProvider
 from pymongo import MongoClient, ASCENDING
 
+from twin_sim import (
+    FLAG_IMPOSSIBLE_HIGH,
+    FLAG_NEGATIVE,
+    FLAG_STUCK,
+    ensure_readings_collection,
+)
+
+try:
+    import redis
+except ImportError:  # redis is optional; /api/readings then skips its cache
+    redis = None
+
 load_dotenv()
 
+
+def _orjson_dumps(obj) -> bytes:
+    # Datetimes serialize as ISO 8601 with a Z suffix; naive ones (as pymongo
+    # returns them) are treated as UTC
+    return orjson.dumps(obj, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() via orjson.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return _orjson_dumps(obj).decode()
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 
 # -----------------------------
@@ -24,8 +59,10 @@ def _get_required_env(name: str) -> str:
     return value
 
 
+@lru_cache(maxsize=None)
 def _client() -> MongoClient:
-    return MongoClient(_get_required_env("MONGO_URI"))
+    # One pooled, thread-safe client per process instead of one per request
+    return MongoClient(_get_required_env("MONGO_URI"), maxPoolSize=50)
 
 
 def _db():
@@ -33,12 +70,99 @@ def _db():
     return _client()[db_name]
 
 
+# Serves the device_id + ts range match in /api/readings
+READINGS_INDEX = [("device_id", ASCENDING), ("ts", ASCENDING)]
+
+
+@lru_cache(maxsize=None)
 def _readings_collection():
+    # Collection and index are ensured on first use only; later calls reuse the handle
     col = _db()["readings"]
-    col.create_index([("device_id", ASCENDING), ("ts", ASCENDING)])
+    ensure_readings_collection(col.database)
+    col.create_index(READINGS_INDEX)
     return col
 
 
+# -----------------------------
+# Redis cache helpers
+# -----------------------------
+READINGS_CACHE_TTL = 60  # seconds
+REDIS_TIMEOUT = 0.25  # seconds
+
+
+@lru_cache(maxsize=None)
+def _redis():
+    """
+    Shared Redis client, or None when redis or REDIS_URL isn't available.
+    """
+    url = os.getenv("REDIS_URL")
+    if redis is None or not url:
+        return None
+    # Short timeouts so an unreachable Redis costs a request a fraction of a
+    # second before the cache is skipped, not the OS connect timeout
+    return redis.Redis.from_url(
+        url,
+        socket_connect_timeout=REDIS_TIMEOUT,
+        socket_timeout=REDIS_TIMEOUT,
+    )
+
+
+def _cache_get(key: str):
+    r = _redis()
+    if r is None:
+        return None
+    try:
+        return r.get(key)
+    except redis.RedisError:
+        return None
+
+
+def _cache_set(key: str, body: bytes, ttl: int) -> None:
+    r = _redis()
+    if r is None:
+        return
+    try:
+        r.setex(key, ttl, body)
+    except redis.RedisError:
+        pass
+
+
+# -----------------------------
+# Request collapsing
+# -----------------------------
+# In-flight /api/readings queries by (device_id, hours, buckets). Concurrent
+# requests for the same window wait on the first one's Future for its body
+# instead of sending their own aggregate to MongoDB.
+_inflight_lock = threading.Lock()
+_inflight_readings = {}
+
+
+# Longest a request waits on another's query before running its own
+READINGS_FLIGHT_TIMEOUT = 10  # seconds
+
+
+def _join_inflight(key):
+    """
+    Returns (future, is_leader). The leader runs the query and must resolve
+    the future through _leave_inflight.
+    """
+    with _inflight_lock:
+        future = _inflight_readings.get(key)
+        if future is not None:
+            return future, False
+        future = _inflight_readings[key] = Future()
+        return future, True
+
+
+def _leave_inflight(key, future, body=None, exc=None) -> None:
+    with _inflight_lock:
+        del _inflight_readings[key]
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(body)
+
+
 def _usage_collection():
     return _db()["daily_usage"]
 
@@ -85,31 +209,30 @@ def generate_admin_checksum(doc):
     ).hexdigest()
 
 
-def _parse_hours(default: int = 24) -> int:
-    try:
-        h = int(request.args.get("hours", default))
-        return max(1, min(168, h))
-    except Exception:
-        return default
-
-
-def _parse_limit(default: int = 500) -> int:
-    try:
-        n = int(request.args.get("limit", default))
-        return max(50, min(5000, n))
-    except Exception:
-        return default
-
-
 # -----------------------------
 # Readings API
 # -----------------------------
-@app.get("/api/readings")
-def api_readings():
-    device_id = request.args.get("device_id") or os.getenv("DEVICE_ID", "ls-100-0001")
-    hours = _parse_hours(24)
-    limit = _parse_limit(1000)
+def _flag_count(bit: int, legacy_field: str) -> dict:
+    """
+    $sum of readings with `bit` set. Readings written before flags became a
+    bitmask carry a sub-document of booleans instead, read via legacy_field.
+    """
+    is_set = {"$cond": [
+        {"$isNumber": "$flags"},
+        {"$bitAnd": ["$flags", bit]},
+        f"$flags.{legacy_field}",
+    ]}
+    return {"$sum": {"$cond": [is_set, 1, 0]}}
 
+
+def _readings_body(device_id: str, hours: int, buckets: int) -> bytes:
+    """
+    Runs the downsampling aggregate for one window and returns the JSON body.
+    The body is built whole rather than streamed: $bucketAuto emits nothing
+    until it has read its entire input and caps the output at `buckets`
+    small results, so streaming wouldn't bring the first byte forward, and
+    a finished body can be handed to collapsed requests and the cache.
+    """
     end = datetime.now(timezone.utc)
     start = end - timedelta(hours=hours)
 
@@ -118,41 +241,96 @@ def api_readings():
         "ts": {"$gte": start, "$lt": end}
     }
 
-    docs = list(
-        _readings_collection()
-        .find(
-            query,
-            {
-                "_id": 0,
-                "ts": 1,
-                "lux_pred": 1,
-                "lux_obs": 1,
-                "cloud_cover": 1,
-                "flags": 1,
+    # Downsample server-side into evenly filled time buckets and count flags
+    # per bucket, so the response is ~buckets points whatever the window size
+    pipeline = [
+        {"$match": query},
+        {"$bucketAuto": {
+            "groupBy": "$ts",
+            "buckets": buckets,
+            "output": {
+                "count": {"$sum": 1},
+                "lux_pred": {"$avg": "$lux_pred"},
+                "lux_obs": {"$avg": "$lux_obs"},
+                "cloud_cover": {"$avg": "$cloud_cover"},
+                "negative": _flag_count(FLAG_NEGATIVE, "is_negative"),
+                "impossible_high": _flag_count(FLAG_IMPOSSIBLE_HIGH, "is_impossible_high"),
+                "stuck": _flag_count(FLAG_STUCK, "is_stuck"),
             },
-        )
-        .sort("ts", 1)
-        .limit(limit)
+        }},
+    ]
+
+    # At most `buckets` results come back, so one wire batch holds them all;
+    # the hint pins the range match to the compound index.
+    cursor = _readings_collection().aggregate(
+        pipeline,
+        hint=READINGS_INDEX,
+        allowDiskUse=False,
+        batchSize=buckets,
     )
 
-    readings = []
-    for doc in docs:
-        ts = doc.get("ts")
-        readings.append({
-            "ts": ts.astimezone(timezone.utc).isoformat().replace("+00:00", "Z") if ts else None,
-            "lux_pred": float(doc.get("lux_pred", 0.0)),
-            "lux_obs": float(doc.get("lux_obs", 0.0)),
-            "cloud_cover": float(doc.get("cloud_cover", 0.0)),
-            "flags": doc.get("flags", {}),
-        })
+    # The totals only exist once every bucket is seen, so they close the object
+    head = {"device_id": device_id, "start": start, "end": end}
+    parts = [_orjson_dumps(head)[:-1] + b',"readings":[']
+
+    count = 0
+    flag_counts = {"negative": 0, "impossible_high": 0, "stuck": 0}
+    for i, bucket in enumerate(cursor):
+        reading = {
+            "ts": bucket["_id"]["min"],
+            "lux_pred": float(bucket.get("lux_pred") or 0.0),
+            "lux_obs": float(bucket.get("lux_obs") or 0.0),
+            "cloud_cover": float(bucket.get("cloud_cover") or 0.0),
+        }
+        parts.append((b"," if i else b"") + _orjson_dumps(reading))
+        count += bucket["count"]
+        for name in flag_counts:
+            flag_counts[name] += bucket[name]
 
-    return jsonify({
-        "device_id": device_id,
-        "start": start.isoformat().replace("+00:00", "Z"),
-        "end": end.isoformat().replace("+00:00", "Z"),
-        "count": len(readings),
-        "readings": readings,
-    })
+    tail = {"count": count, "flag_counts": flag_counts}
+    parts.append(b"]," + _orjson_dumps(tail)[1:])
+    return b"".join(parts)
+
+
+@app.get("/api/readings")
+def api_readings():
+    device_id = request.args.get("device_id") or os.getenv("DEVICE_ID", "ls-100-0001")
+    # type=int falls back to the default on bad input instead of raising
+    hours = max(1, min(168, request.args.get("hours", 24, type=int)))
+    buckets = max(50, min(5000, request.args.get("buckets", 1000, type=int)))
+
+    # Repeat loads of the same window within a minute share one response
+    cache_key = f"rd:{device_id}:{hours}:{buckets}:{int(time.time() // 60)}"
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return Response(cached, mimetype="application/json")
+
+    flight_key = (device_id, hours, buckets)
+    flight, leader = _join_inflight(flight_key)
+    if not leader:
+        try:
+            return Response(flight.result(timeout=READINGS_FLIGHT_TIMEOUT), mimetype="application/json")
+        except Exception:
+            pass  # the shared query failed or stalled; this request runs its own
+
+    try:
+        body = _readings_body(device_id, hours, buckets)
+    except BaseException as exc:
+        # Also covers a killed or timed-out worker (GreenletExit, gevent.Timeout),
+        # which would otherwise leave the window in flight for good. Waiters get
+        # an ordinary error either way, so they fall back to their own query.
+        if leader:
+            if not isinstance(exc, Exception):
+                exc = RuntimeError(f"readings query aborted: {exc!r}")
+            _leave_inflight(flight_key, flight, exc=exc)
+        raise
+
+    # Waiters are released as soon as the body exists, not when this
+    # request's client has finished receiving it
+    if leader:
+        _leave_inflight(flight_key, flight, body)
+    _cache_set(cache_key, body, READINGS_CACHE_TTL)
+    return Response(body, mimetype="application/json")
 
 
 # -----------------------------
@@ -272,148 +450,8 @@ def log_admin_access():
 @app.get("/")
 def index():
     device_id = request.args.get("device_id") or os.getenv("DEVICE_ID", "ls-100-0001")
-    hours = _parse_hours(24)
-
-    html = """
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width,initial-scale=1" />
-  <title>Light Sensor Timeline</title>
-  <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js"></script>
-  <script src="https://cdn.jsdelivr.net/npm/chartjs-adapter-date-fns@3"></script>
-  <style>
-    body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 22px; }
-    .row { display:flex; gap:14px; flex-wrap:wrap; align-items:end; }
-    .card { border:1px solid #ddd; border-radius:12px; padding:14px; max-width:1100px; }
-    label { font-size: 12px; color:#444; display:block; margin-bottom:6px; }
-    input { padding:8px 10px; border:1px solid #ccc; border-radius:10px; }
-    button { padding:9px 12px; border:1px solid #333; border-radius:10px; background:#111; color:#fff; cursor:pointer; }
-    button:disabled { opacity:0.6; cursor:not-allowed; }
-    .meta { color:#666; font-size:12px; margin-top:8px; white-space:pre-wrap; }
-    canvas { width:100% !important; height:420px !important; }
-  </style>
-</head>
-<body>
-  <div class="card">
-    <h2 style="margin:0 0 10px 0;">Light Sensor Timeline</h2>
-
-    <div class="row">
-      <div>
-        <label>device_id</label>
-        <input id="deviceId" value="{{ device_id }}" style="min-width:220px;" />
-      </div>
-      <div>
-        <label>hours</label>
-        <input id="hours" type="number" min="1" max="168" value="{{ hours }}" style="width:100px;" />
-      </div>
-      <div>
-        <label>&nbsp;</label>
-        <button id="loadBtn">Load</button>
-      </div>
-    </div>
-
-    <div class="meta" id="meta"></div>
-    <div style="margin-top:14px;">
-      <canvas id="chart"></canvas>
-    </div>
-  </div>
-
-<script>
-let chart;
-
-function setMeta(txt) {
-  document.getElementById("meta").textContent = txt || "";
-}
-
-async function loadData() {
-  const btn = document.getElementById("loadBtn");
-  btn.disabled = true;
-  setMeta("Loading...");
-
-  const deviceId = document.getElementById("deviceId").value.trim();
-  const hours = Number(document.getElementById("hours").value || 24);
-
-  const url = `/api/readings?device_id=${encodeURIComponent(deviceId)}&hours=${encodeURIComponent(hours)}&limit=2000`;
-  const res = await fetch(url);
-
-  if (!res.ok) {
-    setMeta(`Error: ${res.status} ${res.statusText}`);
-    btn.disabled = false;
-    return;
-  }
-
-  const data = await res.json();
-
-  const pointsPred = data.readings.map(r => ({ x: r.ts, y: r.lux_pred }));
-  const pointsObs = data.readings.map(r => ({ x: r.ts, y: r.lux_obs }));
-
-  const negCount = data.readings.filter(r => r.flags && r.flags.is_negative).length;
-  const highCount = data.readings.filter(r => r.flags && r.flags.is_impossible_high).length;
-  const stuckCount = data.readings.filter(r => r.flags && r.flags.is_stuck).length;
-
-  setMeta(
-`device_id: ${data.device_id}
-window:   ${data.start}  →  ${data.end}
-count:    ${data.count}
-flags:    negative=${negCount}, impossible_high=${highCount}, stuck=${stuckCount}`
-  );
-
-  const ctx = document.getElementById("chart").getContext("2d");
-  if (chart) chart.destroy();
-
-  chart = new Chart(ctx, {
-    type: "line",
-    data: {
-      datasets: [
-        {
-          label: "lux_pred",
-          data: pointsPred,
-          tension: 0.15,
-          borderWidth: 2,
-          pointRadius: 0
-        },
-        {
-          label: "lux_obs",
-          data: pointsObs,
-          tension: 0.15,
-          borderWidth: 2,
-          pointRadius: 0
-        }
-      ]
-    },
-    options: {
-      responsive: true,
-      maintainAspectRatio: false,
-      interaction: { mode: "index", intersect: false },
-      plugins: {
-        legend: { display: true },
-        tooltip: { enabled: true }
-      },
-      scales: {
-        x: {
-          type: "time",
-          time: { tooltipFormat: "PPpp" },
-          ticks: { maxRotation: 0 }
-        },
-        y: {
-          title: { display: true, text: "lux" }
-        }
-      }
-    }
-  });
-
-  btn.disabled = false;
-}
-
-document.getElementById("loadBtn").addEventListener("click", loadData);
-loadData();
-</script>
-</body>
-</html>
-    """
-    return render_template_string(html, device_id=device_id, hours=hours)
+    hours = max(1, min(168, request.args.get("hours", 24, type=int)))
+    return render_template("index.html", device_id=device_id, hours=hours)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+#
+# Production server for the twin viewer (run from this directory):
+#   gunicorn
+#
+# The gevent worker monkey-patches sockets before the app is imported, so
+# while one request waits on MongoDB (or Redis) the worker serves others.
+# The app keeps no per-process state beyond the pooled client, so workers
+# can be scaled freely.
+import os
+
+wsgi_app = "app:app"
+bind = os.getenv("BIND", "127.0.0.1:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gevent"
+worker_connections = 500
@@ -0,0 +1,140 @@
+# test_app.py
+from concurrent.futures import Future
+
+import orjson
+import pytest
+
+import app as twin_app
+
+_BUCKET = {
+    "_id": {"min": "2026-02-01T12:00:00Z"},
+    "count": 3,
+    "lux_pred": 400.0,
+    "lux_obs": 410.0,
+    "cloud_cover": 0.2,
+    "negative": 1,
+    "impossible_high": 0,
+    "stuck": 0,
+}
+
+
+class _WorkerKilled(BaseException):
+    """
+    Stands in for GreenletExit / gevent.Timeout, which aren't Exceptions.
+    """
+
+
+class _FakeReadings:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls += 1
+        if self.fail is True:
+            raise RuntimeError("mongo down")
+        if self.fail:
+            raise self.fail
+        return iter([dict(_BUCKET)])
+
+
+@pytest.fixture
+def readings(monkeypatch):
+    fake = _FakeReadings()
+    monkeypatch.setattr(twin_app, "_readings_collection", lambda: fake)
+    monkeypatch.setattr(twin_app, "_redis", lambda: None)
+    twin_app._inflight_readings.clear()
+    yield fake
+    twin_app._inflight_readings.clear()
+
+
+@pytest.fixture
+def client():
+    twin_app.app.config["TESTING"] = True
+    return twin_app.app.test_client()
+
+
+def test_readings_body_counts_buckets(readings, client):
+    res = client.get("/api/readings?device_id=dev-1&hours=5")
+
+    assert res.status_code == 200
+    data = orjson.loads(res.data)
+    assert data["count"] == 3
+    assert data["flag_counts"] == {"negative": 1, "impossible_high": 0, "stuck": 0}
+    assert len(data["readings"]) == 1
+    assert twin_app._inflight_readings == {}
+
+
+def test_follower_gets_leader_body(readings, client):
+    leader = Future()
+    twin_app._inflight_readings[("dev-1", 5, 1000)] = leader
+    leader.set_result(b'{"from":"leader"}')
+
+    res = client.get("/api/readings?device_id=dev-1&hours=5")
+
+    assert res.data == b'{"from":"leader"}'
+    assert readings.calls == 0
+
+
+def test_head_does_not_leave_window_in_flight(readings, client):
+    assert client.head("/api/readings?device_id=dev-1&hours=5").status_code == 200
+    assert twin_app._inflight_readings == {}
+
+    res = client.get("/api/readings?device_id=dev-1&hours=5")
+    assert res.status_code == 200
+    assert readings.calls == 2
+
+
+def test_follower_runs_own_query_when_leader_fails(readings, client):
+    leader = Future()
+    twin_app._inflight_readings[("dev-1", 5, 1000)] = leader
+    leader.set_exception(RuntimeError("mongo down"))
+
+    res = client.get("/api/readings?device_id=dev-1&hours=5")
+
+    assert res.status_code == 200
+    assert orjson.loads(res.data)["count"] == 3
+    assert readings.calls == 1
+
+
+def test_follower_runs_own_query_when_leader_stalls(readings, client, monkeypatch):
+    monkeypatch.setattr(twin_app, "READINGS_FLIGHT_TIMEOUT", 0.01)
+    twin_app._inflight_readings[("dev-1", 5, 1000)] = Future()
+
+    res = client.get("/api/readings?device_id=dev-1&hours=5")
+
+    assert res.status_code == 200
+    assert readings.calls == 1
+
+
+def test_leader_error_releases_window(readings, client):
+    readings.fail = True
+    twin_app.app.config["PROPAGATE_EXCEPTIONS"] = False
+    try:
+        assert client.get("/api/readings?device_id=dev-1&hours=5").status_code == 500
+    finally:
+        twin_app.app.config["PROPAGATE_EXCEPTIONS"] = None
+    assert twin_app._inflight_readings == {}
+
+    readings.fail = False
+    assert client.get("/api/readings?device_id=dev-1&hours=5").status_code == 200
+
+
+def test_leader_killed_releases_window(readings, client, monkeypatch):
+    released = []
+    leave = twin_app._leave_inflight
+
+    def record_leave(key, future, body=None, exc=None):
+        released.append(future)
+        leave(key, future, body, exc)
+
+    monkeypatch.setattr(twin_app, "_leave_inflight", record_leave)
+    readings.fail = _WorkerKilled()
+    with pytest.raises(_WorkerKilled):
+        client.get("/api/readings?device_id=dev-1&hours=5")
+    assert twin_app._inflight_readings == {}
+    # waiters see an ordinary error they can fall back from
+    assert isinstance(released[0].exception(), Exception)
+
+    readings.fail = False
+    assert client.get("/api/readings?device_id=dev-1&hours=5").status_code == 200
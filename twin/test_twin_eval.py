@@ -0,0 +1,31 @@
+# test_twin_eval.py
+from datetime import datetime, timezone
+
+from twin_eval import evaluate
+from twin_sim import FLAG_NEGATIVE, FLAG_STUCK
+
+
+def _doc(hour, pred, obs, flags):
+    ts = datetime(2026, 2, 1, hour, 0, tzinfo=timezone.utc)
+    return {"ts": ts, "lux_pred": pred, "lux_obs": obs, "flags": flags}
+
+
+def test_evaluate_reads_bitmask_and_legacy_flags():
+    docs = [
+        _doc(9, 300.0, 310.0, FLAG_NEGATIVE | FLAG_STUCK),
+        _doc(12, 450.0, 400.0, {"is_negative": False, "is_impossible_high": True,
+                                "is_dark_alert": False, "is_stuck": True}),
+        _doc(15, 200.0, 200.0, 0),
+    ]
+
+    report = evaluate(docs, tol_lux=25.0)
+
+    assert report["count"] == 3
+    assert report["anomalies"] == {"negative": 1, "impossible_high": 1, "stuck": 2}
+    assert report["peak_hour_pred"] == 12
+    assert report["mae"] == 20.0
+    assert report["within_tol_percent"] == 66.67
+
+
+def test_evaluate_without_data():
+    assert evaluate(iter([])) == {"ok": False, "reason": "no data"}
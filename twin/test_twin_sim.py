@@ -1,10 +1,23 @@
 # test_twin_sim.py
 import os
 from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
+from pymongo.errors import BulkWriteError
 
-from twin_sim import TwinConfig, generate_series, write_to_mongo
+import twin_sim
+from twin_sim import (
+    FLAG_IMPOSSIBLE_HIGH,
+    FLAG_NEGATIVE,
+    INSERT_BATCH_SIZE,
+    TwinConfig,
+    _simulate_arrays_loop,
+    _simulate_arrays_numpy,
+    generate_series,
+    write_to_mongo,
+)
 
 
 def _fixed_cloud(_ts):
@@ -62,13 +75,88 @@ def test_flags_mark_negative_and_high():
 
     # force synthetic edge cases without relying on randomness
     docs[0]["lux_obs"] = -1.0
-    docs[0]["flags"] = {"is_negative": True, "is_impossible_high": False, "is_dark_alert": False, "is_stuck": False}
+    docs[0]["flags"] = FLAG_NEGATIVE
 
     docs[1]["lux_obs"] = 50000.0
-    docs[1]["flags"] = {"is_negative": False, "is_impossible_high": True, "is_dark_alert": False, "is_stuck": False}
+    docs[1]["flags"] = FLAG_IMPOSSIBLE_HIGH
 
-    assert docs[0]["flags"]["is_negative"] is True
-    assert docs[1]["flags"]["is_impossible_high"] is True
+    assert docs[0]["flags"] & FLAG_NEGATIVE
+    assert not docs[0]["flags"] & FLAG_IMPOSSIBLE_HIGH
+    assert docs[1]["flags"] & FLAG_IMPOSSIBLE_HIGH
+    assert not docs[1]["flags"] & FLAG_NEGATIVE
+
+
+def test_cloud_cover_fn_gets_aware_timestamps():
+    cfg = TwinConfig(sampling_seconds=60)
+    start = datetime(2026, 2, 1, 12, 0, tzinfo=timezone(timedelta(hours=-8)))
+    seen = []
+
+    def cloud(ts):
+        seen.append(ts)
+        return 0.2
+
+    docs = generate_series(start, minutes=3, cfg=cfg, cloud_cover_fn=cloud)
+
+    assert seen == [start, start + timedelta(minutes=1), start + timedelta(minutes=2)]
+    assert all(ts.utcoffset() == timedelta(hours=-8) for ts in seen)
+    assert docs[0]["ts"] == datetime(2026, 2, 1, 20, 0)  # stored as naive UTC
+
+
+def test_seed_makes_series_reproducible():
+    cfg = TwinConfig(sampling_seconds=60, anomaly_rate=0.1)
+    start = datetime(2026, 2, 1, 0, 0, tzinfo=timezone.utc)
+
+    docs_a = generate_series(start, minutes=120, cfg=cfg, seed=42)
+    docs_b = generate_series(start, minutes=120, cfg=cfg, seed=42)
+
+    assert [d["lux_obs"] for d in docs_a] == [d["lux_obs"] for d in docs_b]
+    assert [d["cloud_cover"] for d in docs_a] == [d["cloud_cover"] for d in docs_b]
+
+
+def test_loop_kernel_matches_numpy_kernel():
+    # the loop kernel is what numba compiles; it must agree with the NumPy fallback
+    rng = np.random.default_rng(7)
+    n = 2000
+    args = (
+        np.linspace(0.0, 48.0, n) % 24.0,
+        rng.random(n),
+        np.repeat(np.arange(2), n // 2),
+        rng.normal(0.0, 8.0, n),
+        rng.random(n),
+        rng.integers(0, 4, n),
+        2.0, 450.0, 7.0, 18.0, 2.0, 0.1, 10.0, 1000.0,
+    )
+    pred_np, obs_np, bits_np = _simulate_arrays_numpy(*args)
+    pred_loop, obs_loop, bits_loop = _simulate_arrays_loop(*args)
+
+    assert np.allclose(pred_np, pred_loop)
+    assert np.allclose(obs_np, obs_loop)
+    assert np.array_equal(bits_np, bits_loop)
+
+
+class _PartlyFailingCollection:
+    """
+    insert_many stand-in whose first chunk has one rejected document.
+    """
+
+    def __init__(self):
+        self.chunks = 0
+
+    def insert_many(self, docs, ordered):
+        self.chunks += 1
+        if self.chunks == 1:
+            raise BulkWriteError({"nInserted": len(docs) - 1, "writeErrors": [{"index": 0}]})
+        return SimpleNamespace(inserted_ids=list(range(len(docs))))
+
+
+def test_write_to_mongo_continues_after_bad_chunk(monkeypatch):
+    col = _PartlyFailingCollection()
+    monkeypatch.setattr(twin_sim, "_readings_collection", lambda collection: col)
+
+    n = write_to_mongo([{}] * (INSERT_BATCH_SIZE * 2 + 5))
+
+    assert col.chunks == 3
+    assert n == INSERT_BATCH_SIZE * 2 + 4
 
 
 @pytest.mark.skipif(os.environ.get("RUN_ATLAS_INTEGRATION") != "1", reason="Set RUN_ATLAS_INTEGRATION=1 to run")
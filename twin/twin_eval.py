@@ -7,18 +7,31 @@
 # - anomaly counts (negative, impossible high)
 #
 # Requires:
-#   pip install pymongo python-dotenv
+#   pip install pymongo python-dotenv numpy
 #
 # .env:
 #   MONGO_URI=...
 #   DB_NAME=light_sensor_db
 
+import math
 import os
+from itertools import islice
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Tuple
 
+import numpy as np
 from dotenv import load_dotenv
 from pymongo import MongoClient, ASCENDING
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+
+from twin_sim import (
+    FLAG_DARK_ALERT,
+    FLAG_IMPOSSIBLE_HIGH,
+    FLAG_NEGATIVE,
+    FLAG_STUCK,
+    ensure_readings_collection,
+)
 
 load_dotenv()
 
@@ -30,83 +43,106 @@ def _get_required_env(name: str) -> str:
     return v
 
 
+FETCH_BATCH_SIZE = 1000
+
+
 def _client() -> MongoClient:
     return MongoClient(_get_required_env("MONGO_URI"))
 
 
+def _readings_collection(collection: str = "readings") -> Collection:
+    db_name = os.getenv("DB_NAME", "light_sensor_db")
+    return _client()[db_name][collection]
+
+
+def ensure_index(collection: str = "readings") -> None:
+    col = _readings_collection(collection)
+    ensure_readings_collection(col.database, collection)
+    col.create_index([("device_id", ASCENDING), ("ts", ASCENDING)])
+
+
 def fetch_readings(
     device_id: str,
     start: datetime,
     end: datetime,
     collection: str = "readings",
-) -> List[Dict]:
+) -> Cursor:
+    """
+    Returns a cursor over the window; documents arrive in batches of
+    FETCH_BATCH_SIZE as the caller iterates.
+    """
     if start.tzinfo is None:
         start = start.replace(tzinfo=timezone.utc)
     if end.tzinfo is None:
         end = end.replace(tzinfo=timezone.utc)
 
-    db_name = os.getenv("DB_NAME", "light_sensor_db")
-    col = _client()[db_name][collection]
-    col.create_index([("device_id", ASCENDING), ("ts", ASCENDING)])
-
+    col = _readings_collection(collection)
     q = {"device_id": device_id, "ts": {"$gte": start, "$lt": end}}
-    return list(col.find(q, {"_id": 0}).sort("ts", 1))
-
-
-def mae(errors: List[float]) -> float:
-    return sum(abs(e) for e in errors) / max(1, len(errors))
-
-
-def rmse(errors: List[float]) -> float:
-    return (sum(e * e for e in errors) / max(1, len(errors))) ** 0.5
-
+    return col.find(q, {"_id": 0}).sort("ts", 1).batch_size(FETCH_BATCH_SIZE)
 
-def percent_within_band(obs: List[float], pred: List[float], tol: float) -> float:
-    within = 0
-    for o, p in zip(obs, pred):
-        if abs(o - p) <= tol:
-            within += 1
-    return 100.0 * within / max(1, len(obs))
 
-
-def peak_hour(pred_series: List[Dict]) -> Tuple[int, float]:
+def _flag_bits(flags) -> int:
     """
-    Returns (hour_of_peak, peak_pred_lux).
+    Returns a reading's flags as a FLAG_* bitmask. Readings written before
+    flags became a bitmask store a sub-document of booleans instead.
     """
-    best = None
-    for d in pred_series:
-        p = float(d.get("lux_pred", 0.0))
-        ts = d["ts"]
-        if best is None or p > best[1]:
-            best = (ts.hour, p)
-    return best if best else (-1, 0.0)
-
-
-def evaluate(readings: List[Dict], tol_lux: float = 25.0) -> Dict:
-    if not readings:
+    if isinstance(flags, dict):
+        return (
+            (FLAG_NEGATIVE if flags.get("is_negative") else 0)
+            | (FLAG_IMPOSSIBLE_HIGH if flags.get("is_impossible_high") else 0)
+            | (FLAG_DARK_ALERT if flags.get("is_dark_alert") else 0)
+            | (FLAG_STUCK if flags.get("is_stuck") else 0)
+        )
+    return flags or 0
+
+
+def _eval_row(d: Dict) -> Tuple:
+    return (d["lux_pred"], d["lux_obs"], d["ts"].hour, _flag_bits(d.get("flags")))
+
+
+def evaluate(readings: Iterable[Dict], tol_lux: float = 25.0) -> Dict:
+    # The cursor is read FETCH_BATCH_SIZE documents at a time; each chunk is
+    # reduced with NumPy into running totals, so the window is never held whole
+    n = within = 0
+    abs_sum = sq_sum = 0.0
+    pk_hour, pk_val = -1, 0.0
+    neg = high = stuck = 0
+    readings = iter(readings)
+    while True:
+        chunk = [_eval_row(d) for d in islice(readings, FETCH_BATCH_SIZE)]
+        if not chunk:
+            break
+        rows = np.array(chunk, dtype=float)
+        pred, obs = rows[:, 0], rows[:, 1]
+        bits = rows[:, 3].astype(np.int64)
+        errors = obs - pred
+
+        abs_errors = np.abs(errors)
+        abs_sum += float(abs_errors.sum())
+        sq_sum += float((errors * errors).sum())
+        within += int(np.count_nonzero(abs_errors <= tol_lux))
+
+        pk = int(np.argmax(pred))
+        if n == 0 or pred[pk] > pk_val:
+            pk_hour, pk_val = int(rows[pk, 2]), float(pred[pk])
+        n += len(chunk)
+
+        neg += int(np.count_nonzero(bits & FLAG_NEGATIVE))
+        high += int(np.count_nonzero(bits & FLAG_IMPOSSIBLE_HIGH))
+        stuck += int(np.count_nonzero(bits & FLAG_STUCK))
+
+    if n == 0:
         return {"ok": False, "reason": "no data"}
 
-    pred = [float(d["lux_pred"]) for d in readings]
-    obs = [float(d["lux_obs"]) for d in readings]
-    errors = [o - p for o, p in zip(obs, pred)]
-
-    flags = [d.get("flags", {}) for d in readings]
-    neg = sum(1 for f in flags if f.get("is_negative"))
-    high = sum(1 for f in flags if f.get("is_impossible_high"))
-    stuck = sum(1 for f in flags if f.get("is_stuck"))
-
-    pk_hour, pk_val = peak_hour(readings)
-
     # Simple “sanity” conditions (adjust for your building)
     peak_ok = 10 <= pk_hour <= 14  # midday window
-    within = percent_within_band(obs, pred, tol=tol_lux)
 
     return {
         "ok": True,
-        "count": len(readings),
-        "mae": round(mae(errors), 3),
-        "rmse": round(rmse(errors), 3),
-        "within_tol_percent": round(within, 2),
+        "count": n,
+        "mae": round(abs_sum / n, 3),
+        "rmse": round(math.sqrt(sq_sum / n), 3),
+        "within_tol_percent": round(100.0 * within / n, 2),
         "tol_lux": tol_lux,
         "peak_hour_pred": pk_hour,
         "peak_pred_lux": round(pk_val, 2),
@@ -126,6 +162,7 @@ def main() -> None:
     end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
     start = end - timedelta(hours=24)
 
+    ensure_index("readings")
     readings = fetch_readings(device_id=device_id, start=start, end=end, collection="readings")
     report = evaluate(readings, tol_lux=25.0)
 
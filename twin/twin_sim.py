@@ -6,7 +6,9 @@
 # - Writes documents to MongoDB Atlas
 #
 # Requirements:
-#   pip install pymongo python-dotenv
+#   pip install pymongo python-dotenv numpy
+# Optional (JIT-compiles the simulation kernel for long batch runs):
+#   pip install numba
 #
 # Local .env (DO NOT COMMIT):
 #   MONGO_URI=...
@@ -17,10 +19,19 @@ import math
 import random
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Callable, Dict, Iterable, List, Optional
 
+import numpy as np
 from dotenv import load_dotenv
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, WriteConcern
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; generate_series then runs on plain NumPy
+    njit = None
 
 # Load .env if present (local dev). In CI, env vars come from secrets.
 load_dotenv()
@@ -51,44 +62,68 @@ class TwinConfig:
     impossible_high_lux: float = 20000.0
 
 
-def _clamp(x: float, lo: float, hi: float) -> float:
-    return max(lo, min(hi, x))
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 def _fractional_hour(ts: datetime) -> float:
     return ts.hour + ts.minute / 60.0 + ts.second / 3600.0
 
 
+def _daylight_shape(h: float, sunrise: float, sunset: float) -> Optional[float]:
+    if h < sunrise or h > sunset:
+        return None
+    x = (h - sunrise) / (sunset - sunrise)  # 0..1
+    return math.sin(math.pi * x)  # 0 at sunrise/sunset, 1 at midday
+
+
+@lru_cache(maxsize=None)
+def _shape_lut(sunrise: float, sunset: float) -> tuple:
+    """
+    Daylight shape for every whole minute of the day (None at night), so
+    minute-aligned samples skip the sin call.
+    """
+    return tuple(_daylight_shape(m // 60 + (m % 60) / 60.0, sunrise, sunset) for m in range(1440))
+
+
 def predicted_lux(ts: datetime, cloud_cover: float, cfg: TwinConfig) -> float:
     """
     Predict lux using a smooth day curve:
       - night lux outside sunrise..sunset
       - sine curve between sunrise and sunset (peaks at midday)
-      - cloud_cover in [0,1] attenuates intensity
+      - cloud_cover attenuates intensity; it must already be in [0,1]
+        (callers clamp it once, as generate_series does)
     """
-    h = _fractional_hour(ts)
-    if h < cfg.sunrise_hour or h > cfg.sunset_hour:
+    if ts.second or ts.microsecond:
+        daylight_shape = _daylight_shape(_fractional_hour(ts), cfg.sunrise_hour, cfg.sunset_hour)
+    else:
+        daylight_shape = _shape_lut(cfg.sunrise_hour, cfg.sunset_hour)[ts.hour * 60 + ts.minute]
+    if daylight_shape is None:
         return cfg.night_lux
 
-    span = cfg.sunset_hour - cfg.sunrise_hour
-    x = (h - cfg.sunrise_hour) / span  # 0..1
-    daylight_shape = math.sin(math.pi * x)  # 0 at sunrise/sunset, 1 at midday
-
-    attenuation = 1.0 - 0.75 * _clamp(cloud_cover, 0.0, 1.0)
+    attenuation = 1.0 - 0.75 * cloud_cover
     lux = cfg.night_lux + (cfg.peak_lux - cfg.night_lux) * daylight_shape * attenuation
     return max(0.0, lux)
 
 
-def observed_lux(pred_lux: float, day_index: int, cfg: TwinConfig) -> float:
+# Anomaly kinds injected into observed readings; the simulation kernels
+# draw an index into this tuple
+ANOMALY_KINDS = ("stuck_low", "stuck_high", "spike", "negative")
+
+
+def observed_lux(
+    pred_lux: float, day_index: int, cfg: TwinConfig, rng: Optional[random.Random] = None
+) -> float:
     """
     Observed lux = predicted + drift + noise + occasional anomaly injection.
+    Pass a random.Random for reproducible draws; defaults to the module RNG.
     """
+    rng = rng or random
     drift = cfg.drift_per_day * day_index
-    noise = random.gauss(0.0, cfg.noise_sigma)
+    noise = rng.gauss(0.0, cfg.noise_sigma)
     obs = pred_lux + drift + noise
 
-    if random.random() < cfg.anomaly_rate:
-        kind = random.choice(["stuck_low", "stuck_high", "spike", "negative"])
+    if rng.random() < cfg.anomaly_rate:
+        kind = ANOMALY_KINDS[rng.randrange(len(ANOMALY_KINDS))]
         if kind == "stuck_low":
             obs = 0.0
         elif kind == "stuck_high":
@@ -115,57 +150,187 @@ def classify_reading(lux: float, cfg: TwinConfig) -> Dict[str, bool]:
     }
 
 
+# Bits of the per-reading flags bitmask, as produced by the simulation
+# kernels and stored in each document's "flags" field
+FLAG_NEGATIVE = 1
+FLAG_IMPOSSIBLE_HIGH = 2
+FLAG_DARK_ALERT = 4
+FLAG_STUCK = 8
+
+
+def _simulate_arrays_numpy(
+    hours, cloud_cover, day_index, noise, anomaly_u, anomaly_kind,
+    night, peak, sunrise, sunset, drift_per_day, anomaly_rate, alert_threshold, impossible_high,
+):
+    """
+    Numeric core of generate_series over whole arrays; returns (pred, obs, flag_bits).
+    cloud_cover must already be in [0,1]. A reading is an anomaly when its
+    anomaly_u draw is below anomaly_rate; anomaly_kind indexes ANOMALY_KINDS.
+    """
+    x = (hours - sunrise) / (sunset - sunrise)
+    day_lux = night + (peak - night) * np.sin(np.pi * x) * (1.0 - 0.75 * cloud_cover)
+    is_day = (hours >= sunrise) & (hours <= sunset)
+    pred = np.maximum(0.0, np.where(is_day, day_lux, night))
+
+    obs = pred + drift_per_day * day_index + noise
+    is_anomaly = anomaly_u < anomaly_rate
+    obs = np.where(is_anomaly & (anomaly_kind == 0), 0.0, obs)
+    obs = np.where(is_anomaly & (anomaly_kind == 1), peak * 2.0, obs)
+    obs = np.where(is_anomaly & (anomaly_kind == 2), pred + peak * 3.0, obs)
+    obs = np.where(is_anomaly & (anomaly_kind == 3), -50.0, obs)
+
+    # very simple stuck detector based on exact equality with the previous reading
+    is_stuck = np.zeros(len(obs), dtype=bool)
+    is_stuck[1:] = np.abs(np.diff(obs)) < 1e-12
+
+    flag_bits = (
+        (obs < 0.0) * FLAG_NEGATIVE
+        | (obs > impossible_high) * FLAG_IMPOSSIBLE_HIGH
+        | ((obs >= 0.0) & (obs < alert_threshold)) * FLAG_DARK_ALERT
+        | is_stuck * FLAG_STUCK
+    ).astype(np.uint8)
+    return pred, obs, flag_bits
+
+
+def _simulate_arrays_loop(
+    hours, cloud_cover, day_index, noise, anomaly_u, anomaly_kind,
+    night, peak, sunrise, sunset, drift_per_day, anomaly_rate, alert_threshold, impossible_high,
+):
+    """
+    Same kernel as _simulate_arrays_numpy written as one fused loop, which
+    numba compiles without the NumPy temporaries.
+    """
+    n = hours.shape[0]
+    pred = np.empty(n)
+    obs = np.empty(n)
+    flag_bits = np.zeros(n, dtype=np.uint8)
+    span = sunset - sunrise
+
+    for i in range(n):
+        h = hours[i]
+        if h < sunrise or h > sunset:
+            p = night
+        else:
+            shape = np.sin(np.pi * (h - sunrise) / span)
+            p = night + (peak - night) * shape * (1.0 - 0.75 * cloud_cover[i])
+        p = max(0.0, p)
+
+        o = p + drift_per_day * day_index[i] + noise[i]
+        if anomaly_u[i] < anomaly_rate:
+            kind = anomaly_kind[i]
+            if kind == 0:
+                o = 0.0
+            elif kind == 1:
+                o = peak * 2.0
+            elif kind == 2:
+                o = p + peak * 3.0
+            else:
+                o = -50.0
+
+        bits = 0
+        if o < 0.0:
+            bits |= FLAG_NEGATIVE
+        if o > impossible_high:
+            bits |= FLAG_IMPOSSIBLE_HIGH
+        if o >= 0.0 and o < alert_threshold:
+            bits |= FLAG_DARK_ALERT
+        if i > 0 and abs(o - obs[i - 1]) < 1e-12:
+            bits |= FLAG_STUCK
+
+        pred[i] = p
+        obs[i] = o
+        flag_bits[i] = bits
+    return pred, obs, flag_bits
+
+
+if njit is not None:
+    _simulate_arrays = njit(cache=True, fastmath=True)(_simulate_arrays_loop)
+else:
+    _simulate_arrays = _simulate_arrays_numpy
+
+
 def generate_series(
     start_ts: datetime,
     minutes: int,
     cfg: TwinConfig,
     cloud_cover_fn: Optional[Callable[[datetime], float]] = None,
+    seed: Optional[int] = None,
 ) -> List[Dict]:
     """
     Generate documents for MongoDB:
-      - ts (datetime, UTC)
+      - ts (naive datetime in UTC, as pymongo stores and returns it;
+        cloud_cover_fn receives the same instants as aware datetimes in
+        start_ts's timezone)
       - lux_pred, lux_obs
-      - flags
+      - flags (int bitmask of FLAG_* bits)
       - cloud_cover
+
+    The numeric work runs on NumPy arrays; dicts are only built at the end.
+    All random draws come from one NumPy Generator, seeded by seed if given.
     """
     if start_ts.tzinfo is None:
         start_ts = start_ts.replace(tzinfo=timezone.utc)
 
     total_points = int((minutes * 60) / cfg.sampling_seconds)
-    out: List[Dict] = []
-    prev_obs: Optional[float] = None
-
-    for i in range(total_points):
-        ts = start_ts + timedelta(seconds=i * cfg.sampling_seconds)
-        day_index = (ts.date() - start_ts.date()).days
-
-        cloud_cover = float(cloud_cover_fn(ts)) if cloud_cover_fn else random.random()
-        cloud_cover = _clamp(cloud_cover, 0.0, 1.0)
-
-        pred = predicted_lux(ts, cloud_cover, cfg)
-        obs = observed_lux(pred, day_index, cfg)
-
-        flags = classify_reading(obs, cfg)
-
-        # very simple stuck detector based on exact equality
-        is_stuck = False
-        if prev_obs is not None and abs(obs - prev_obs) < 1e-12:
-            is_stuck = True
-        prev_obs = obs
-
-        doc = {
+    if total_points <= 0:
+        return []
+    rng = np.random.default_rng(seed)
+
+    offsets = np.arange(total_points, dtype=np.int64) * cfg.sampling_seconds
+    # Timestamps are built in one NumPy pass as naive UTC datetimes, which is
+    # how pymongo stores and returns them
+    start_us = (start_ts - _EPOCH) // timedelta(microseconds=1)
+    ts_list = (start_us + offsets * 1_000_000).astype("datetime64[us]").tolist()
+
+    # Wall-clock seconds since the start day's midnight (in start_ts's timezone)
+    # give both the fractional hour, matching _fractional_hour(ts), and the day index
+    wall_seconds = start_ts.hour * 3600 + start_ts.minute * 60 + start_ts.second + offsets
+    hours = (wall_seconds / 3600.0) % 24.0
+    day_index = wall_seconds // 86400
+
+    if cloud_cover_fn:
+        # The callback sees aware datetimes in start_ts's timezone, as before
+        # the stored timestamps became naive UTC
+        tz = start_ts.tzinfo
+        cloud_cover = np.array([
+            float(cloud_cover_fn(ts.replace(tzinfo=timezone.utc).astimezone(tz))) for ts in ts_list
+        ])
+    else:
+        cloud_cover = rng.random(total_points)
+    cloud_cover = np.clip(cloud_cover, 0.0, 1.0)
+
+    pred, obs, flag_bits = _simulate_arrays(
+        hours,
+        cloud_cover,
+        day_index,
+        rng.normal(0.0, cfg.noise_sigma, total_points),
+        rng.random(total_points),
+        rng.integers(0, len(ANOMALY_KINDS), total_points),
+        cfg.night_lux,
+        cfg.peak_lux,
+        cfg.sunrise_hour,
+        cfg.sunset_hour,
+        cfg.drift_per_day,
+        cfg.anomaly_rate,
+        cfg.alert_lux_threshold,
+        cfg.impossible_high_lux,
+    )
+
+    return [
+        {
             "room_id": cfg.room_id,
             "device_id": cfg.device_id,
             "model_version": cfg.model_version,
             "ts": ts,
-            "cloud_cover": cloud_cover,
-            "lux_pred": float(pred),
-            "lux_obs": float(obs),
-            "flags": {**flags, "is_stuck": is_stuck},
+            "cloud_cover": cloud,
+            "lux_pred": p,
+            "lux_obs": o,
+            "flags": bits,
         }
-        out.append(doc)
-
-    return out
+        for ts, cloud, p, o, bits in zip(
+            ts_list, cloud_cover.tolist(), pred.tolist(), obs.tolist(), flag_bits.tolist()
+        )
+    ]
 
 
 def _get_required_env(name: str) -> str:
@@ -181,27 +346,77 @@ def get_mongo_client() -> MongoClient:
     return MongoClient(uri)
 
 
-def write_to_mongo(docs: Iterable[Dict], collection: str = "readings") -> int:
-    """
-    Writes docs to MongoDB Atlas in DB_NAME (from .env/env).
-    Returns number of inserted docs.
-    """
+# Documents per insert_many call; keeps each call within a few wire batches
+INSERT_BATCH_SIZE = 1000
+
+
+def _readings_collection(collection: str):
     db_name = os.getenv("DB_NAME", "light_sensor_db")
+    # Simulated readings don't need a journal ack per write
+    return get_mongo_client()[db_name].get_collection(
+        collection, write_concern=WriteConcern(w=1, j=False)
+    )
 
-    client = get_mongo_client()
-    db = client[db_name]
-    col = db[collection]
 
-    # Helpful indexes for time-series querying
+# Readings are stored in a MongoDB time-series collection: documents are
+# bucketed per device and compressed column-wise, so range scans over ts
+# read far fewer blocks than in a plain collection. The room_id index below
+# is on a measurement field, which time-series collections allow from 6.0.
+READINGS_TIMESERIES = {"timeField": "ts", "metaField": "device_id", "granularity": "minutes"}
+READINGS_STORAGE_ENGINE = {"wiredTiger": {"configString": "block_compressor=zstd"}}
+
+
+def ensure_readings_collection(db: Database, collection: str = "readings") -> None:
+    """
+    Creates the readings time-series collection if it doesn't exist yet.
+    Every program that touches readings calls this before create_index,
+    which would otherwise create a plain collection implicitly. An existing
+    plain collection is left as is; it has to be migrated by hand.
+    """
+    if db.list_collection_names(filter={"name": collection}):
+        return
+    try:
+        db.create_collection(
+            collection,
+            timeseries=READINGS_TIMESERIES,
+            storageEngine=READINGS_STORAGE_ENGINE,
+        )
+    except CollectionInvalid:
+        pass  # created concurrently by another process
+    except OperationFailure as e:
+        if e.code != 48:  # NamespaceExists
+            raise
+
+
+def ensure_indexes(collection: str = "readings") -> None:
+    """
+    Creates the readings time-series collection (if missing) and its query
+    indexes. Call once at startup, not per write.
+    """
+    col = _readings_collection(collection)
+    ensure_readings_collection(col.database, collection)
     col.create_index([("device_id", ASCENDING), ("ts", ASCENDING)])
     col.create_index([("room_id", ASCENDING), ("ts", ASCENDING)])
 
-    docs_list = list(docs)
-    if not docs_list:
-        return 0
 
-    res = col.insert_many(docs_list, ordered=True)
-    return len(res.inserted_ids)
+def write_to_mongo(docs: Iterable[Dict], collection: str = "readings") -> int:
+    """
+    Writes docs to MongoDB Atlas in DB_NAME (from .env/env).
+    Inserts are unordered and chunked; a chunk with bad docs still inserts
+    its good ones and the remaining chunks are written as usual.
+    Returns number of inserted docs.
+    """
+    col = _readings_collection(collection)
+
+    docs_list = list(docs)
+    inserted = 0
+    for i in range(0, len(docs_list), INSERT_BATCH_SIZE):
+        try:
+            res = col.insert_many(docs_list[i:i + INSERT_BATCH_SIZE], ordered=False)
+            inserted += len(res.inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get("nInserted", 0)
+    return inserted
 
 
 def main() -> None:
@@ -213,6 +428,7 @@ def main() -> None:
     start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
     docs = generate_series(start_ts=start, minutes=24 * 60, cfg=cfg)
 
+    ensure_indexes(collection="readings")
     n = write_to_mongo(docs, collection="readings")
     db_name = os.getenv("DB_NAME", "light_sensor_db")
     print(f"Inserted {n} docs into {db_name}.readings")